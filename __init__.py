@@ -31,6 +31,7 @@ from .services import (
     confirm_agent,
     create_agent,
     delete_agent_template_var,
+    flush_pending_touch_writes,
     fork_agent,
     get_active_agents_for_chat,
     get_agent,
@@ -43,7 +44,6 @@ from .services import (
     set_agent_template_var,
     start_agent_task,
     stop_all_tasks,
-    update_agent,
     wake_up_agent,
 )
 
@@ -99,19 +99,18 @@ async def create_webapp_agent(
     # 验证难度范围
     difficulty = max(1, min(10, difficulty))
 
-    # 创建 Agent
-    agent, error = await create_agent(_ctx.chat_key, requirement.strip(), difficulty)
+    # 创建 Agent（模板变量随创建一并保存）
+    agent, error = await create_agent(
+        _ctx.chat_key,
+        requirement.strip(),
+        difficulty,
+        template_vars={str(key): str(value) for key, value in template_vars.items()} if template_vars else None,
+    )
     if error:
         raise RuntimeError(f"创建失败: {error}")
     if not agent:
         raise RuntimeError("创建失败: 未知错误")
 
-    # 设置模板变量
-    if template_vars:
-        for key, value in template_vars.items():
-            agent.set_template_var(str(key), str(value))
-        await update_agent(agent)
-
     # 启动 Agent 工作
     await start_agent_task(agent.agent_id, _ctx.chat_key)
 
@@ -581,6 +580,7 @@ async def clean_up() -> None:
     """清理插件资源，停止所有运行中的任务"""
     try:
         stopped_count = await stop_all_tasks()
+        await flush_pending_touch_writes()
         if stopped_count > 0:
             logger.info(f"WebApp 插件已清理 {stopped_count} 个运行中的任务")
         else:
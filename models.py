@@ -201,27 +201,32 @@ class WebDevAgent(BaseModel):
         self.confirmed_time = int(time.time())
         self.last_access_time = int(time.time())
 
-    def should_auto_archive(self, auto_archive_minutes: int) -> bool:
+    def should_auto_archive(self, auto_archive_minutes: int, now: Optional[int] = None) -> bool:
         """检查是否应该自动归档"""
         if self.status != AgentStatus.WAITING_CONFIRM:
             return False
-        elapsed_minutes = (int(time.time()) - self.last_access_time) / 60
+        if now is None:
+            now = int(time.time())
+        elapsed_minutes = (now - self.last_access_time) / 60
         return elapsed_minutes >= auto_archive_minutes
 
-    def is_timeout(self, timeout_minutes: int) -> bool:
+    def is_timeout(self, timeout_minutes: int, now: Optional[int] = None) -> bool:
         """检查是否超时（长时间等待反馈）
 
         对于 WAITING_FEEDBACK 状态的 Agent，如果超过指定时间无响应，视为超时。
 
         Args:
             timeout_minutes: 超时时间（分钟）
+            now: 当前时间戳，批量检查时可传入以复用同一时刻
 
         Returns:
             是否超时
         """
         if self.status != AgentStatus.WAITING_FEEDBACK:
             return False
-        elapsed_minutes = (int(time.time()) - self.last_active_time) / 60
+        if now is None:
+            now = int(time.time())
+        elapsed_minutes = (now - self.last_active_time) / 60
         return elapsed_minutes >= timeout_minutes
 
     def add_message(
@@ -347,6 +352,10 @@ class ChatAgentRegistry(BaseModel):
         """获取活跃 Agent 数量"""
         return len(self.active_agents)
 
+    def get_working_count(self) -> int:
+        """获取正在工作的 Agent 数量（不包括待确认状态）"""
+        return sum(1 for agent in self.active_agents.values() if agent.is_working())
+
     def list_active_agents(self) -> List[WebDevAgent]:
         """列出所有活跃 Agent"""
         return list(self.active_agents.values())
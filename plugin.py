@@ -72,6 +72,18 @@ class WebAppConfig(ConfigBase):
         description="任务难度评分达到此值及以上时使用高级模型 (1-10)",
     )
 
+    PROMPT_CACHE_CONTROL: bool = Field(
+        default=False,
+        title="启用提示词缓存断点",
+        description="为子 Agent 请求附加 cache_control 缓存断点（适用于 Anthropic Claude 等需显式声明缓存的模型服务，OpenAI 等自动缓存的服务无需开启）",
+    )
+
+    FALLBACK_HEDGE_SECONDS: int = Field(
+        default=0,
+        title="降级模型对冲等待时间（秒）",
+        description="当前模型超过此时间仍未返回时，同时向下一个降级模型发起请求，采用先成功的结果（0 表示关闭，仅在失败后依次降级）",
+    )
+
     # ==================== 并发控制 ====================
 
     MAX_CONCURRENT_AGENTS_PER_CHAT: int = Field(
@@ -118,6 +130,14 @@ class WebAppConfig(ConfigBase):
         description="开启后，主Agent向用户表达时会明确提及助手；关闭后，主Agent会将子Agent的工作视为自己的工作",
     )
 
+    # ==================== 状态注入配置 ====================
+
+    COMPACT_INJECT: bool = Field(
+        default=False,
+        title="精简状态注入",
+        description="开启后，注入主 Agent 提示词的子 Agent 状态改为每个任务一行的精简格式，可显著减少每轮对话的 Token 消耗",
+    )
+
 
 # 获取配置实例
 config: WebAppConfig = plugin.get_config(WebAppConfig)
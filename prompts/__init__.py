@@ -1,11 +1,40 @@
-"""提示词模块"""
+"""提示词模块
 
-from .main_inject import inject_webapp_status
-from .webdev_system import build_webdev_messages, build_webdev_system_prompt
+子模块按需加载：子 Agent 提示词仅在工作循环启动时才会被导入。
+"""
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .main_inject import inject_webapp_status
+    from .webdev_system import (
+        apply_cache_control,
+        build_webdev_messages,
+        build_webdev_system_prompt,
+    )
+
+# 导出名称 -> 所在子模块
+_LAZY_EXPORTS = {
+    "apply_cache_control": "webdev_system",
+    "build_webdev_messages": "webdev_system",
+    "build_webdev_system_prompt": "webdev_system",
+    "inject_webapp_status": "main_inject",
+}
 
 __all__ = [
+    "apply_cache_control",
     "build_webdev_messages",
     "build_webdev_system_prompt",
     "inject_webapp_status",
 ]
 
+
+def __getattr__(name: str) -> Any:
+    """首次访问时导入对应子模块并缓存导出对象"""
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
@@ -3,13 +3,40 @@
 为主 Agent 提供当前所有活跃子 Agent 的状态视图。
 """
 
+import bisect
 import time
 
 from nekro_agent.api.schemas import AgentCtx
 
-from ..models import AgentStatus
+from ..models import AgentStatus, WebDevAgent
 from ..plugin import config
-from ..services.agent_pool import auto_archive_expired_agents, load_chat_registry
+from ..services.agent_pool import load_chat_registry_with_auto_archive
+
+# 状态图标
+_STATUS_ICONS = {
+    AgentStatus.PENDING: "⏳",
+    AgentStatus.THINKING: "🤔",
+    AgentStatus.CODING: "💻",
+    AgentStatus.DEPLOYING: "🚀",
+    AgentStatus.WAITING_FEEDBACK: "💬",
+    AgentStatus.WAITING_CONFIRM: "✅",
+    AgentStatus.COMPLETED: "✅",
+    AgentStatus.FAILED: "❌",
+    AgentStatus.CANCELLED: "🚫",
+}
+
+# 难度分档：难度 < 4 为基础，4-5 简单，6-7 中等，>= 8 困难
+_DIFFICULTY_THRESHOLDS = (4, 6, 8)
+_DIFFICULTY_BADGES = ("⚪ 基础", "🟢 简单", "🟡 中等", "🔴 困难")
+
+# 标题模板：(有任务时的标题, 无任务时的标题)
+_TITLES_TRANSPARENT = ("## 🤖 网页开发助手团队 ({n} 个任务)\n", "## 🤖 网页开发助手团队\n")
+_TITLES_IMMERSIVE = ("## 🎯 当前网页开发工作 ({n} 项)\n", "## 🎯 网页开发工作\n")
+_SECTION_WORKING = "### 📋 进行中 ({n})"
+_SECTION_CONFIRMED = "### ✅ 已完成待归档 ({n})"
+
+# 一分钟以内的耗时文本（最常见的情况）
+_SEC_STRINGS = tuple(f"{i}秒" for i in range(60))
 
 
 async def inject_webapp_status(_ctx: AgentCtx) -> str:
@@ -21,53 +48,50 @@ async def inject_webapp_status(_ctx: AgentCtx) -> str:
     Returns:
         注入的提示词内容
     """
-    # 先检查并自动归档超时的 Agent
-    await auto_archive_expired_agents(_ctx.chat_key)
-
-    registry = await load_chat_registry(_ctx.chat_key)
-
-    # 分类 Agent
-    working_agents = {
-        agent_id: agent
-        for agent_id, agent in registry.active_agents.items()
-        if agent.is_working()
-    }
-    confirmed_agents = {
-        agent_id: agent
-        for agent_id, agent in registry.active_agents.items()
-        if agent.status == AgentStatus.WAITING_CONFIRM
-    }
+    # 加载注册表并自动归档超时的 Agent（只读取一次存储）
+    registry = await load_chat_registry_with_auto_archive(_ctx.chat_key)
+
+    # 单次遍历分类 Agent
+    working_agents: list[tuple[str, WebDevAgent]] = []
+    confirmed_agents: list[tuple[str, WebDevAgent]] = []
+    for agent_id, agent in registry.active_agents.items():
+        if agent.is_working():
+            working_agents.append((agent_id, agent))
+        elif agent.status == AgentStatus.WAITING_CONFIRM:
+            confirmed_agents.append((agent_id, agent))
+
+    now = int(time.time())
 
     prompt_parts: list[str] = []
 
-    # 标题（根据身份呈现模式选择）
+    # 标题（根据身份呈现模式选择：透明式明确是助手团队，沉浸式作为自己的工作）
     total_active = len(registry.active_agents)
-    if config.TRANSPARENT_SUB_AGENT:
-        # 透明式：明确是助手团队
-        if total_active > 0:
-            prompt_parts.append(f"## 🤖 网页开发助手团队 ({total_active} 个任务)\n")
-        else:
-            prompt_parts.append("## 🤖 网页开发助手团队\n")
+    title_template, empty_title = (
+        _TITLES_TRANSPARENT if config.TRANSPARENT_SUB_AGENT else _TITLES_IMMERSIVE
+    )
+    if total_active > 0:
+        prompt_parts.append(title_template.format(n=total_active))
     else:
-        # 沉浸式：作为自己的工作
-        if total_active > 0:
-            prompt_parts.append(f"## 🎯 当前网页开发工作 ({total_active} 项)\n")
-        else:
-            prompt_parts.append("## 🎯 网页开发工作\n")
+        prompt_parts.append(empty_title)
 
     # 正在工作的 Agent
     if working_agents:
-        prompt_parts.append(f"### 📋 进行中 ({len(working_agents)})")
-        for agent_id, agent in working_agents.items():
-            prompt_parts.append(_format_agent_status(agent_id, agent))
+        prompt_parts.append(_SECTION_WORKING.format(n=len(working_agents)))
+        format_status = (
+            _format_agent_status_compact
+            if config.COMPACT_INJECT
+            else _format_agent_status
+        )
+        for agent_id, agent in working_agents:
+            prompt_parts.append(format_status(agent_id, agent, now))
         prompt_parts.append("")
 
     # 已确认待归档的 Agent
     if confirmed_agents:
-        prompt_parts.append(f"### ✅ 已完成待归档 ({len(confirmed_agents)})")
-        for agent_id, agent in confirmed_agents.items():
+        prompt_parts.append(_SECTION_CONFIRMED.format(n=len(confirmed_agents)))
+        for agent_id, agent in confirmed_agents:
             elapsed = _format_elapsed(
-                int(time.time()) - (agent.confirmed_time or agent.create_time),
+                now - (agent.confirmed_time or agent.create_time),
             )
             url_info = f" | 🔗 {agent.deployed_url}" if agent.deployed_url else ""
             prompt_parts.append(
@@ -95,13 +119,13 @@ async def inject_webapp_status(_ctx: AgentCtx) -> str:
     return "\n".join(prompt_parts)
 
 
-def _format_agent_status(agent_id: str, agent) -> str:  # noqa: ANN001
+def _format_agent_status(agent_id: str, agent: WebDevAgent, now: int) -> str:
     """格式化单个 Agent 状态"""
     # 状态图标
     status_icon = _get_status_icon(agent.status)
 
     # 计算工作时间
-    elapsed_seconds = int(time.time()) - agent.create_time
+    elapsed_seconds = now - agent.create_time
     elapsed = _format_elapsed(elapsed_seconds)
 
     # 难度标识
@@ -150,36 +174,38 @@ def _format_agent_status(agent_id: str, agent) -> str:  # noqa: ANN001
     return "\n".join(lines)
 
 
+def _format_agent_status_compact(agent_id: str, agent: WebDevAgent, now: int) -> str:
+    """格式化单个 Agent 状态（精简单行格式）"""
+    requirement = agent.requirement[:30] + ("..." if len(agent.requirement) > 30 else "")
+    parts = [
+        f"- [{agent_id}] {agent.status.value} {agent.progress_percent}% {_format_elapsed(now - agent.create_time)}",
+        requirement,
+    ]
+    if agent.current_step:
+        parts.append(agent.current_step)
+    if agent.deployed_url:
+        parts.append(agent.deployed_url)
+    if agent.status == AgentStatus.WAITING_FEEDBACK:
+        parts.append(f'需要反馈: send_to_webapp_agent("{agent_id}", "反馈内容")')
+    return " | ".join(parts)
+
+
 def _get_status_icon(status: AgentStatus) -> str:
     """获取状态图标"""
-    return {
-        AgentStatus.PENDING: "⏳",
-        AgentStatus.THINKING: "🤔",
-        AgentStatus.CODING: "💻",
-        AgentStatus.DEPLOYING: "🚀",
-        AgentStatus.WAITING_FEEDBACK: "💬",
-        AgentStatus.WAITING_CONFIRM: "✅",
-        AgentStatus.COMPLETED: "✅",
-        AgentStatus.FAILED: "❌",
-        AgentStatus.CANCELLED: "🚫",
-    }.get(status, "❓")
+    return _STATUS_ICONS.get(status, "❓")
 
 
 def _get_difficulty_badge(difficulty: int) -> str:
     """获取难度徽章"""
-    if difficulty >= 8:
-        return "🔴 困难"
-    if difficulty >= 6:
-        return "🟡 中等"
-    if difficulty >= 4:
-        return "🟢 简单"
-    return "⚪ 基础"
+    return _DIFFICULTY_BADGES[bisect.bisect_right(_DIFFICULTY_THRESHOLDS, difficulty)]
 
 
 def _format_elapsed(seconds: int) -> str:
     """格式化耗时"""
+    # 时钟回拨等情况下可能出现负值，按 0 秒处理
+    seconds = max(seconds, 0)
     if seconds < 60:
-        return f"{seconds}秒"
+        return _SEC_STRINGS[seconds]
     minutes = seconds // 60
     secs = seconds % 60
     if minutes < 60:
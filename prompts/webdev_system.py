@@ -1,94 +1,23 @@
 """子 Agent 系统提示词
 
 构建子 Agent 的系统提示词和消息历史。
+
+与主 Agent 的沟通记录只在 build_webdev_messages 中以对话消息的形式出现，
+每轮变化的状态放在对话历史之后，避免破坏前缀缓存。
 """
 
-import time
-from typing import List
+from typing import Any, Dict, List
 
 from nekro_agent.services.agent.creator import OpenAIChatMessage
 
 from ..models import AgentStatus, MessageType, WebDevAgent
 from ..plugin import config
 
-
-def build_webdev_system_prompt(agent: WebDevAgent) -> str:
-    """构建子 Agent 的系统提示词
-
-    Args:
-        agent: Agent 实例
-
-    Returns:
-        系统提示词
-    """
-    # 格式化通信历史
-    messages_history = ""
-    if agent.messages:
-        messages_history = "\n## 与主 Agent 的沟通记录\n```\n"
-        for msg in agent.messages[-10:]:  # 最近 10 条
-            time_str = time.strftime("%H:%M:%S", time.localtime(msg.timestamp))
-            sender = "主Agent" if msg.sender == "main" else "我"
-            messages_history += (
-                f"[{time_str}] {sender} ({msg.msg_type.value}): {msg.content}\n"
-            )
-        messages_history += "```\n"
-
-    # 当前 HTML 状态
-    html_status = ""
-    if agent.current_html:
-        max_len = config.HTML_PREVIEW_LENGTH
-        if len(agent.current_html) > max_len:
-            html_preview = (
-                agent.current_html[:max_len]
-                + f"\n\n... (共 {len(agent.current_html)} 字符，已截断)"
-            )
-        else:
-            html_preview = agent.current_html
-        html_status = f"""
-## 当前代码状态
-已完成的 HTML 代码 ({len(agent.current_html)} 字符):
-```html
-{html_preview}
-```
-"""
-
-    # 模板变量概览
-    template_vars_section = ""
-    if agent.template_vars:
-        template_vars_section = "\n## 📦 可用模板变量\n\n"
-        template_vars_section += "主 Agent 提供了以下模板变量，你可以在 HTML 中使用 `{{变量名}}` 占位符引用：\n\n"
-        template_vars_section += "| 变量名 | 内容预览 |\n|--------|----------|\n"
-        for key, preview in agent.get_all_template_previews(
-            config.TEMPLATE_VAR_PREVIEW_LEN,
-        ).items():
-            # 转义 Markdown 表格特殊字符
-            safe_preview = preview.replace("|", "\\|").replace("\n", " ")[:100]
-            template_vars_section += f"| `{key}` | {safe_preview} |\n"
-        template_vars_section += "\n**使用方式**: 在 HTML 中写入 `{{变量名}}`，部署时会自动替换为实际内容。\n"
-        template_vars_section += '**示例**: `<img src="{{logo_base64}}" alt="Logo">` 或 `<p>{{intro_text}}</p>`\n'
-
-    return f"""# 你是 WebDev Agent [{agent.agent_id}]
+# 子 Agent 系统提示词的静态部分（角色、输出协议与规范），所有 Agent 共享
+_STATIC_SYSTEM_PROMPT = """# 你是 WebDev Agent
 
 你是一个专业的网页开发 Agent，隶属于 NekroAgent 系统。你的职责是根据主 Agent 转达的用户需求，独立完成网页开发任务。
 
-## 你的身份
-
-- Agent ID: {agent.agent_id}
-- 当前状态: {agent.status.value}
-- 进度: {agent.progress_percent}%
-- 迭代次数: {agent.iteration_count}
-
-## 当前任务
-
-**原始需求:**
-> {agent.requirement}
-
-**任务概要:**
-{agent.task_summary or "(待分析)"}
-
-**当前步骤:**
-{agent.current_step or "(待开始)"}
-{messages_history}{html_status}{template_vars_section}
 ## 你的能力和规范
 
 ### 1. 状态更新
@@ -179,17 +108,134 @@ step: "正在编写响应式布局CSS"
 - 代码必须是完整的、可独立运行的 HTML
 - 如果主 Agent 提出修改意见，在原有代码基础上修改，保持整体结构
 - 对于不确定的设计细节，主动询问而不是自行决定
+
 """
 
 
+# 子 Agent 系统提示词的任务部分（身份与任务），同一 Agent 的多轮调用间保持不变
+_TASK_SYSTEM_PROMPT_TEMPLATE = """## 你的身份
+
+- Agent ID: {agent_id}
+
+## 当前任务
+
+**原始需求:**
+> {requirement}
+
+**任务概要:**
+{task_summary}
+"""
+
+# 每轮变化的当前状态，作为最后一条 user 消息放在对话历史之后
+_STATE_MESSAGE_TEMPLATE = """[系统] 当前状态
+
+- 状态: {status}
+- 进度: {progress_percent}%
+- 迭代次数: {iteration_count}
+- 当前步骤: {current_step}
+{html_status}{template_vars_section}{continue_hint}"""
+
+_HTML_STATUS_TEMPLATE = """
+## 当前代码状态
+已完成的 HTML 代码 ({html_length} 字符):
+```html
+{html_preview}
+```
+"""
+
+_CONTINUE_HINT = "\n请继续你的工作，记得更新状态和进度。"
+
+# Markdown 表格特殊字符转义表
+_TABLE_ESCAPE = str.maketrans({"|": "\\|", "\n": " "})
+
+
+def build_webdev_system_prompt(agent: WebDevAgent) -> str:
+    """构建子 Agent 的系统提示词
+
+    只包含静态规范与任务信息，每轮变化的状态由 build_webdev_messages 放在对话末尾。
+
+    Args:
+        agent: Agent 实例
+
+    Returns:
+        系统提示词
+    """
+    return _STATIC_SYSTEM_PROMPT + _TASK_SYSTEM_PROMPT_TEMPLATE.format(
+        agent_id=agent.agent_id,
+        requirement=agent.requirement,
+        task_summary=agent.task_summary or "(待分析)",
+    )
+
+
+def _build_state_message(agent: WebDevAgent) -> str:
+    """构建当前状态消息（状态、进度、代码与模板变量）
+
+    Args:
+        agent: Agent 实例
+
+    Returns:
+        状态消息内容
+    """
+    # 当前 HTML 状态
+    html_status = ""
+    if agent.current_html:
+        max_len = config.HTML_PREVIEW_LENGTH
+        if len(agent.current_html) > max_len:
+            html_preview = (
+                agent.current_html[:max_len]
+                + f"\n\n... (共 {len(agent.current_html)} 字符，已截断)"
+            )
+        else:
+            html_preview = agent.current_html
+        html_status = _HTML_STATUS_TEMPLATE.format(
+            html_length=len(agent.current_html),
+            html_preview=html_preview,
+        )
+
+    # 模板变量概览
+    template_vars_section = ""
+    if agent.template_vars:
+        var_parts = [
+            "\n## 📦 可用模板变量\n\n",
+            "主 Agent 提供了以下模板变量，你可以在 HTML 中使用 `{{变量名}}` 占位符引用：\n\n",
+            "| 变量名 | 内容预览 |\n|--------|----------|\n",
+        ]
+        for key, preview in agent.get_all_template_previews(
+            config.TEMPLATE_VAR_PREVIEW_LEN,
+        ).items():
+            safe_preview = preview.translate(_TABLE_ESCAPE)[:100]
+            var_parts.append(f"| `{key}` | {safe_preview} |\n")
+        var_parts.append("\n**使用方式**: 在 HTML 中写入 `{{变量名}}`，部署时会自动替换为实际内容。\n")
+        var_parts.append('**示例**: `<img src="{{logo_base64}}" alt="Logo">` 或 `<p>{{intro_text}}</p>`\n')
+        template_vars_section = "".join(var_parts)
+
+    # 继续工作提示 (如果是被唤醒继续工作)
+    continue_hint = ""
+    if agent.status in [AgentStatus.THINKING, AgentStatus.CODING]:
+        continue_hint = _CONTINUE_HINT
+
+    return _STATE_MESSAGE_TEMPLATE.format(
+        status=agent.status.value,
+        progress_percent=agent.progress_percent,
+        iteration_count=agent.iteration_count,
+        current_step=agent.current_step or "(待开始)",
+        html_status=html_status,
+        template_vars_section=template_vars_section,
+        continue_hint=continue_hint,
+    )
+
+
 def build_webdev_messages(agent: WebDevAgent) -> List[OpenAIChatMessage]:
     """构建子 Agent 的完整消息历史
 
+    消息按 "系统提示词 -> 初始任务 -> 对话历史 -> 当前状态" 排列：
+    除最后一条状态消息外，前缀在多轮调用间保持不变，便于模型服务端命中前缀缓存。
+
     Args:
         agent: Agent 实例
 
     Returns:
-        消息列表
+        消息列表，最后一条固定为当前状态消息
     """
     messages: List[OpenAIChatMessage] = []
 
@@ -224,13 +270,35 @@ def build_webdev_messages(agent: WebDevAgent) -> List[OpenAIChatMessage]:
             # 自己的历史回复
             messages.append(OpenAIChatMessage.from_text("assistant", msg.content))
 
-    # 4. 继续工作提示 (如果是被唤醒继续工作)
-    if agent.status in [AgentStatus.THINKING, AgentStatus.CODING]:
-        messages.append(
-            OpenAIChatMessage.from_text(
-                "user",
-                "[系统] 请继续你的工作，记得更新状态和进度。",
-            ),
-        )
+    # 4. 当前状态（每轮变化，放在最后）
+    messages.append(OpenAIChatMessage.from_text("user", _build_state_message(agent)))
 
     return messages
+
+
+def apply_cache_control(messages: List[OpenAIChatMessage]) -> List[Dict[str, Any]]:
+    """为消息列表附加 cache_control 缓存断点
+
+    断点设在系统提示词末尾和最后一条稳定消息（末尾状态消息之前的一条）上。
+    对话历史只会追加，下一轮请求的前缀包含本轮断点之前的全部内容，可以直接命中缓存。
+
+    Args:
+        messages: 由 build_webdev_messages 构建的消息列表
+
+    Returns:
+        可直接传给 gen_openai_chat_response 的消息字典列表
+    """
+    result = [msg.to_dict() for msg in messages]
+
+    # 末尾的状态消息每轮都会变化，不设断点
+    for index in sorted({0, len(result) - 2}):
+        if index < 0:
+            continue
+        content = result[index]["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        if not content:
+            continue
+        content[-1] = {**content[-1], "cache_control": {"type": "ephemeral"}}
+        result[index]["content"] = content
+    return result
@@ -2,6 +2,7 @@
 
 from .agent_pool import (
     add_message_to_agent,
+    agent_transaction,
     archive_agent,
     auto_archive_expired_agents,
     cancel_agent,
@@ -10,6 +11,7 @@ from .agent_pool import (
     create_agent,
     delete_agent_template_var,
     fail_agent,
+    flush_pending_touch_writes,
     force_archive_oldest_confirmed,
     fork_agent,
     get_active_agents_for_chat,
@@ -21,15 +23,13 @@ from .agent_pool import (
     get_chat_registry,
     get_resumable_agents,
     load_chat_registry,
+    load_chat_registry_with_auto_archive,
     register_active_chat_key,
     reset_failed_agent,
     save_chat_registry,
     set_agent_template_var,
     unregister_chat_key_if_empty,
     update_agent,
-    update_agent_deployed_url,
-    update_agent_html,
-    update_agent_progress,
     update_agent_status,
 )
 from .agent_runner import (
@@ -44,6 +44,7 @@ from .message_bus import notify_main_agent, send_to_webdev_agent
 
 __all__ = [
     "add_message_to_agent",
+    "agent_transaction",
     "archive_agent",
     "auto_archive_expired_agents",
     "cancel_agent",
@@ -54,6 +55,7 @@ __all__ = [
     "delete_agent_template_var",
     "deploy_html_to_worker",
     "fail_agent",
+    "flush_pending_touch_writes",
     "force_archive_oldest_confirmed",
     "fork_agent",
     "get_active_agents_for_chat",
@@ -66,6 +68,7 @@ __all__ = [
     "get_resumable_agents",
     "get_running_task_keys",
     "load_chat_registry",
+    "load_chat_registry_with_auto_archive",
     "notify_main_agent",
     "register_active_chat_key",
     "reset_failed_agent",
@@ -77,9 +80,6 @@ __all__ = [
     "stop_all_tasks",
     "unregister_chat_key_if_empty",
     "update_agent",
-    "update_agent_deployed_url",
-    "update_agent_html",
-    "update_agent_progress",
     "update_agent_status",
     "wake_up_agent",
 ]
@@ -5,9 +5,11 @@
 """
 
 import asyncio
-import os
+import contextlib
+import random
 import time
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from nekro_agent.api.core import logger
 
@@ -34,21 +36,169 @@ def _get_chat_lock(chat_key: str) -> asyncio.Lock:
 # ==================== 数据持久化 ====================
 
 
+# 进程内注册表缓存（LRU + 短 TTL）
+# 宿主的管理接口可以直接修改或删除插件数据而不经过 save_chat_registry，
+# 因此缓存只在很短的时间内有效，过期后重新从存储读取
+_REGISTRY_CACHE_SIZE = 64
+_REGISTRY_CACHE_TTL = 1.0
+# 缓存存储原始 JSON，命中时重新解析（比深拷贝模型更快，且天然得到独立副本）
+_registry_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+# 进程内完整保存计数，用于判断延迟写入期间是否发生过保存
+_registry_versions: Dict[str, int] = {}
+
+
+def _cache_registry(chat_key: str, data: str) -> None:
+    """写入注册表缓存，超出容量时淘汰最久未使用的会话"""
+    _registry_cache[chat_key] = (time.monotonic(), data)
+    _registry_cache.move_to_end(chat_key)
+    while len(_registry_cache) > _REGISTRY_CACHE_SIZE:
+        _registry_cache.popitem(last=False)
+
+
 async def load_chat_registry(chat_key: str) -> ChatAgentRegistry:
-    """加载会话级 Agent 注册表"""
-    data = await store.get(chat_key=chat_key, store_key="webapp_agents")
-    if data:
-        return ChatAgentRegistry.model_validate_json(data)
-    return ChatAgentRegistry()
+    """加载会话级 Agent 注册表
+
+    缓存未过期时跳过存储读取，并合并尚未写入的访问时间。
+    每次调用都返回新解析的实例，调用方可以自由修改，修改需通过 save_chat_registry 保存后才会生效。
+    """
+    data: Optional[str] = None
+    cached = _registry_cache.get(chat_key)
+    if cached is not None:
+        cached_at, cached_data = cached
+        if time.monotonic() - cached_at < _REGISTRY_CACHE_TTL:
+            _registry_cache.move_to_end(chat_key)
+            data = cached_data
+        else:
+            del _registry_cache[chat_key]
+
+    if data is None:
+        data = await store.get(chat_key=chat_key, store_key="webapp_agents") or ""
+        _cache_registry(chat_key, data)
+
+    registry = (
+        ChatAgentRegistry.model_validate_json(data) if data else ChatAgentRegistry()
+    )
+
+    touches = _pending_touch.get(chat_key)
+    if touches:
+        _apply_touches(registry, touches)
+    return registry
 
 
 async def save_chat_registry(chat_key: str, registry: ChatAgentRegistry) -> None:
-    """保存会话级 Agent 注册表"""
-    await store.set(
-        chat_key=chat_key,
-        store_key="webapp_agents",
-        value=registry.model_dump_json(),
-    )
+    """保存会话级 Agent 注册表
+
+    尚未写入的访问时间会先合并到注册表中（取较新值），随本次保存一并写入。
+    """
+    touches = _pending_touch.pop(chat_key, None)
+    if touches:
+        _apply_touches(registry, touches)
+    _registry_versions[chat_key] = _registry_versions.get(chat_key, 0) + 1
+    data = registry.model_dump_json()
+    await store.set(chat_key=chat_key, store_key="webapp_agents", value=data)
+    _cache_registry(chat_key, data)
+
+
+@contextlib.asynccontextmanager
+async def agent_transaction(
+    chat_key: str,
+    agent_id: str,
+) -> AsyncIterator[Optional[WebDevAgent]]:
+    """单个活跃 Agent 的注册表事务
+
+    同一会话的事务之间通过会话级锁串行执行，代码块内抛出异常时不保存。
+    Agent 已不在活跃列表中时产出 None，且不保存注册表。
+
+    Examples:
+        async with agent_transaction(chat_key, agent_id) as agent:
+            if agent:
+                agent.update_status(AgentStatus.CODING)
+    """
+    async with _get_chat_lock(chat_key):
+        registry = await load_chat_registry(chat_key)
+        agent = registry.active_agents.get(agent_id)
+        yield agent
+        if agent is not None:
+            await save_chat_registry(chat_key, registry)
+
+
+# ==================== 访问时间延迟写入 ====================
+
+# 仅更新访问时间的写入会延迟合并，避免每次读取 Agent 都触发一次完整保存
+# 待写入项为 会话 -> {Agent ID: 最后访问时间}
+_TOUCH_FLUSH_DELAY = 5.0
+_pending_touch: Dict[str, Dict[str, int]] = {}
+_touch_flush_task: Optional[asyncio.Task] = None
+
+
+def _apply_touches(registry: ChatAgentRegistry, touches: Dict[str, int]) -> bool:
+    """将延迟的访问时间合并到注册表（只更新仍在活跃列表中的 Agent，取较新值）
+
+    Returns:
+        注册表是否发生变化
+    """
+    changed = False
+    for agent_id, access_time in touches.items():
+        agent = registry.active_agents.get(agent_id)
+        if agent and access_time > agent.last_access_time:
+            agent.last_access_time = access_time
+            changed = True
+    return changed
+
+
+def _defer_touch_write(chat_key: str, agent_id: str, access_time: int) -> None:
+    """登记 Agent 的访问时间，稍后统一写入存储"""
+    global _touch_flush_task
+
+    touches = _pending_touch.setdefault(chat_key, {})
+    touches[agent_id] = max(touches.get(agent_id, 0), access_time)
+
+    if _touch_flush_task is None or _touch_flush_task.done():
+        _touch_flush_task = asyncio.create_task(_flush_touch_writes_later())
+
+
+async def _flush_touch_writes_later() -> None:
+    """等待一段时间后写入所有延迟的访问时间"""
+    global _touch_flush_task
+
+    await asyncio.sleep(_TOUCH_FLUSH_DELAY)
+    _touch_flush_task = None
+    await flush_pending_touch_writes()
+
+
+async def flush_pending_touch_writes() -> int:
+    """立即写入所有延迟的访问时间（插件清理时调用）
+
+    写入前重新读取存储，只更新存储中仍存在的 Agent，
+    不会恢复已被外部修改或删除（例如宿主管理接口）的数据。
+
+    Returns:
+        写入的会话数量
+    """
+    flushed = 0
+    for chat_key in list(_pending_touch):
+        version = _registry_versions.get(chat_key, 0)
+        try:
+            data = await store.get(chat_key=chat_key, store_key="webapp_agents")
+            # 读取期间发生过完整保存时，访问时间已随保存写入
+            touches = _pending_touch.get(chat_key)
+            if not touches or _registry_versions.get(chat_key, 0) != version:
+                continue
+            del _pending_touch[chat_key]
+            if not data:
+                continue
+
+            registry = ChatAgentRegistry.model_validate_json(data)
+            if not _apply_touches(registry, touches):
+                continue
+            _registry_versions[chat_key] = version + 1
+            data = registry.model_dump_json()
+            await store.set(chat_key=chat_key, store_key="webapp_agents", value=data)
+            _cache_registry(chat_key, data)
+            flushed += 1
+        except Exception as e:
+            logger.warning(f"写入会话 {chat_key} 的 Agent 访问时间失败: {e}")
+    return flushed
 
 
 # ==================== Agent CRUD ====================
@@ -56,46 +206,54 @@ async def save_chat_registry(chat_key: str, registry: ChatAgentRegistry) -> None
 
 def generate_agent_id() -> str:
     """生成唯一 Agent ID"""
-    suffix = os.urandom(2).hex()
-    return f"WEB_{suffix}"
+    # ID 仅用于区分会话内的 Agent，无需密码学强度的随机数
+    return f"WEB_{random.getrandbits(16):04x}"
 
 
 async def create_agent(
     chat_key: str,
     requirement: str,
     difficulty: int = 5,
+    template_vars: Optional[Dict[str, str]] = None,
+    fork_from: Optional[WebDevAgent] = None,
 ) -> Tuple[Optional[WebDevAgent], Optional[str]]:
     """创建新的 Agent
 
+    初始状态（模板变量、分支来源的成果）在保存前一并写入，只保存一次。
+
     Args:
         chat_key: 所属会话
         requirement: 任务需求
         difficulty: 任务难度评分 (1-10)
+        template_vars: 初始模板变量
+        fork_from: 分支来源 Agent，会复制其 HTML 成果、页面信息和模板变量
 
     Returns:
         Tuple[WebDevAgent, Optional[str]]: (Agent 实例, 错误信息)
     """
+    # 所有归档与创建操作在同一份注册表上完成，只读写一次存储
+    registry = await load_chat_registry(chat_key)
+
     # 先自动归档超时的 Agent
-    archived = await auto_archive_expired_agents(chat_key)
+    archived, failed = _archive_expired_in_place(registry)
     if archived:
         logger.info(f"创建前自动归档了 {len(archived)} 个超时 Agent")
-
-    registry = await load_chat_registry(chat_key)
+    changed = bool(archived or failed)
 
     # 检查并发限制 - 会话级（只计算正在工作的 Agent）
-    working_count = len([a for a in registry.active_agents.values() if a.is_working()])
+    working_count = registry.get_working_count()
     if working_count >= config.MAX_CONCURRENT_AGENTS_PER_CHAT:
         # 尝试强制归档最早的已确认 Agent
-        forced_id = await force_archive_oldest_confirmed(chat_key)
+        forced_id = _force_archive_oldest_confirmed_in_place(registry)
         if forced_id:
             logger.info(f"达到并发上限，强制归档 Agent: {forced_id}")
-            registry = await load_chat_registry(chat_key)
-            working_count = len(
-                [a for a in registry.active_agents.values() if a.is_working()],
-            )
+            changed = True
+            working_count = registry.get_working_count()
 
     # 再次检查
     if working_count >= config.MAX_CONCURRENT_AGENTS_PER_CHAT:
+        if changed:
+            await save_chat_registry(chat_key, registry)
         return (
             None,
             f"当前会话已有 {working_count} 个正在工作的 Agent，达到上限 {config.MAX_CONCURRENT_AGENTS_PER_CHAT}",
@@ -114,6 +272,25 @@ async def create_agent(
         content=requirement,
     )
 
+    # 复制分支来源的成果
+    if fork_from:
+        agent.current_html = fork_from.current_html
+        agent.template_vars = fork_from.template_vars.copy()
+        agent.page_title = fork_from.page_title
+        agent.page_description = fork_from.page_description
+
+        # 添加分支说明到消息
+        agent.add_message(
+            msg_type=MessageType.INSTRUCTION,
+            sender="main",
+            content=f"[基于 {fork_from.agent_id} 分支] {requirement}",
+        )
+
+    # 设置初始模板变量
+    if template_vars:
+        for key, value in template_vars.items():
+            agent.set_template_var(key, value)
+
     # 保存到会话注册表
     registry.add_agent(agent)
     await save_chat_registry(chat_key, registry)
@@ -146,7 +323,7 @@ async def get_agent(
     agent = registry.get_agent(agent_id)
     if agent and update_access:
         agent.touch()
-        await save_chat_registry(chat_key, registry)
+        _defer_touch_write(chat_key, agent_id, agent.last_access_time)
     return agent
 
 
@@ -213,39 +390,38 @@ async def archive_agent(agent_id: str, chat_key: str) -> Optional[WebDevAgent]:
     return agent
 
 
-async def auto_archive_expired_agents(chat_key: str) -> List[str]:
-    """自动归档超时的已确认 Agent，并标记超时的等待中 Agent 为失败
+def _archive_expired_in_place(
+    registry: ChatAgentRegistry,
+) -> Tuple[List[str], List[str]]:
+    """在已加载的注册表上归档超时 Agent（不负责保存）
 
     Returns:
-        已归档的 Agent ID 列表
+        (已归档的 Agent ID 列表, 因超时标记为失败的 Agent ID 列表)
     """
-    registry = await load_chat_registry(chat_key)
+    now = int(time.time())
     archived_ids: List[str] = []
     failed_ids: List[str] = []
 
-    # 1. 归档超时的已确认 Agent
-    agents_to_archive = [
-        agent_id
-        for agent_id, agent in registry.active_agents.items()
-        if agent.should_auto_archive(config.AUTO_ARCHIVE_MINUTES)
-    ]
+    # 单次遍历分类：超时的已确认 Agent 归档，超时的等待反馈 Agent 标记为失败
+    agents_to_archive: List[str] = []
+    agents_to_fail: List[str] = []
+    for agent_id, agent in registry.active_agents.items():
+        if agent.should_auto_archive(config.AUTO_ARCHIVE_MINUTES, now):
+            agents_to_archive.append(agent_id)
+        elif agent.is_timeout(config.AGENT_TIMEOUT_MINUTES, now):
+            agents_to_fail.append(agent_id)
 
+    # 1. 归档超时的已确认 Agent
     for agent_id in agents_to_archive:
         agent = registry.active_agents.get(agent_id)
         if agent:
             agent.update_status(AgentStatus.COMPLETED)
-            agent.complete_time = int(time.time())
+            agent.complete_time = now
             registry.archive_agent(agent_id, config.MAX_COMPLETED_HISTORY)
             archived_ids.append(agent_id)
             logger.info(f"自动归档超时 Agent: {agent_id}")
 
     # 2. 标记超时的等待反馈 Agent 为失败
-    agents_to_fail = [
-        agent_id
-        for agent_id, agent in registry.active_agents.items()
-        if agent.is_timeout(config.AGENT_TIMEOUT_MINUTES)
-    ]
-
     for agent_id in agents_to_fail:
         agent = registry.active_agents.get(agent_id)
         if agent:
@@ -256,50 +432,97 @@ async def auto_archive_expired_agents(chat_key: str) -> List[str]:
             failed_ids.append(agent_id)
             logger.warning(f"Agent {agent_id} 等待反馈超时，已归档")
 
+    return archived_ids, failed_ids
+
+
+async def _load_and_archive(chat_key: str) -> Tuple[ChatAgentRegistry, List[str]]:
+    """加载会话注册表并归档超时 Agent，有变化时才保存
+
+    Returns:
+        (已完成自动归档的注册表, 已归档的 Agent ID 列表)
+    """
+    registry = await load_chat_registry(chat_key)
+    archived_ids, failed_ids = _archive_expired_in_place(registry)
+
     if archived_ids or failed_ids:
         await save_chat_registry(chat_key, registry)
 
+    return registry, archived_ids
+
+
+async def auto_archive_expired_agents(chat_key: str) -> List[str]:
+    """自动归档超时的已确认 Agent，并标记超时的等待中 Agent 为失败
+
+    Returns:
+        已归档的 Agent ID 列表
+    """
+    _, archived_ids = await _load_and_archive(chat_key)
     return archived_ids
 
 
+async def load_chat_registry_with_auto_archive(chat_key: str) -> ChatAgentRegistry:
+    """加载会话注册表，并在同一次读取中完成超时 Agent 的自动归档
+
+    等价于先调用 auto_archive_expired_agents 再调用 load_chat_registry，
+    但只读取一次存储。
+
+    Returns:
+        已完成自动归档的会话注册表
+    """
+    registry, _ = await _load_and_archive(chat_key)
+    return registry
+
+
 async def get_archived_agents_count(chat_key: str) -> int:
     """获取已归档 Agent 数量"""
     registry = await load_chat_registry(chat_key)
     return len(registry.completed_agents)
 
 
-async def force_archive_oldest_confirmed(chat_key: str) -> Optional[str]:
-    """强制归档最早的已确认 Agent（当达到并发上限时调用）
+def _force_archive_oldest_confirmed_in_place(registry: ChatAgentRegistry) -> Optional[str]:
+    """在已加载的注册表上归档最早的已确认 Agent（不负责保存）
 
     Returns:
         被归档的 Agent ID，如果没有可归档的则返回 None
     """
-    registry = await load_chat_registry(chat_key)
-
-    # 查找所有 WAITING_CONFIRM 状态的 Agent，按确认时间排序
-    confirmed_agents = [
-        (agent_id, agent)
-        for agent_id, agent in registry.active_agents.items()
-        if agent.status == AgentStatus.WAITING_CONFIRM
-    ]
+    # 在所有 WAITING_CONFIRM 状态的 Agent 中取确认时间最早的
+    oldest = min(
+        (
+            (agent_id, agent)
+            for agent_id, agent in registry.active_agents.items()
+            if agent.status == AgentStatus.WAITING_CONFIRM
+        ),
+        key=lambda x: x[1].confirmed_time or 0,
+        default=None,
+    )
 
-    if not confirmed_agents:
+    if oldest is None:
         return None
 
-    # 按确认时间排序，取最早的
-    confirmed_agents.sort(key=lambda x: x[1].confirmed_time or 0)
-    oldest_id, oldest_agent = confirmed_agents[0]
+    oldest_id, oldest_agent = oldest
 
     # 归档
     oldest_agent.update_status(AgentStatus.COMPLETED)
     oldest_agent.complete_time = int(time.time())
     registry.archive_agent(oldest_id, config.MAX_COMPLETED_HISTORY)
-    await save_chat_registry(chat_key, registry)
 
     logger.info(f"强制归档最早的已确认 Agent: {oldest_id}")
     return oldest_id
 
 
+async def force_archive_oldest_confirmed(chat_key: str) -> Optional[str]:
+    """强制归档最早的已确认 Agent（当达到并发上限时调用）
+
+    Returns:
+        被归档的 Agent ID，如果没有可归档的则返回 None
+    """
+    registry = await load_chat_registry(chat_key)
+    oldest_id = _force_archive_oldest_confirmed_in_place(registry)
+    if oldest_id:
+        await save_chat_registry(chat_key, registry)
+    return oldest_id
+
+
 async def cancel_agent(
     agent_id: str,
     chat_key: str,
@@ -373,70 +596,22 @@ async def add_message_to_agent(
     return msg
 
 
-async def update_agent_progress(
-    agent_id: str,
-    chat_key: str,
-    percent: int,
-    step: str,
-) -> Optional[WebDevAgent]:
-    """更新 Agent 进度"""
-    agent = await get_agent(agent_id, chat_key)
-    if not agent:
-        return None
-
-    agent.update_progress(percent, step)
-    await update_agent(agent)
-    return agent
-
-
 async def update_agent_status(
     agent_id: str,
     chat_key: str,
     status: AgentStatus,
 ) -> Optional[WebDevAgent]:
-    """更新 Agent 状态"""
-    agent = await get_agent(agent_id, chat_key)
-    if not agent:
-        return None
-
-    agent.update_status(status)
-    await update_agent(agent)
-    return agent
-
-
-async def update_agent_html(
-    agent_id: str,
-    chat_key: str,
-    html_content: str,
-    title: Optional[str] = None,
-    description: Optional[str] = None,
-) -> Optional[WebDevAgent]:
-    """更新 Agent 的 HTML 内容"""
-    agent = await get_agent(agent_id, chat_key)
+    """更新 Agent 状态（状态未变化时不写入）"""
+    agent = await get_agent(agent_id, chat_key, update_access=False)
     if not agent:
         return None
 
-    agent.current_html = html_content
-    if title:
-        agent.page_title = title
-    if description:
-        agent.page_description = description
+    # 重复进入等待反馈状态需要刷新活跃时间，重新计算反馈超时
+    if agent.status == status and status != AgentStatus.WAITING_FEEDBACK:
+        return agent
 
-    await update_agent(agent)
-    return agent
-
-
-async def update_agent_deployed_url(
-    agent_id: str,
-    chat_key: str,
-    url: str,
-) -> Optional[WebDevAgent]:
-    """更新 Agent 的部署 URL"""
-    agent = await get_agent(agent_id, chat_key)
-    if not agent:
-        return None
-
-    agent.deployed_url = url
+    agent.touch()
+    agent.update_status(status)
     await update_agent(agent)
     return agent
 
@@ -620,27 +795,18 @@ async def fork_agent(
         new_difficulty if new_difficulty is not None else source_agent.difficulty
     )
 
-    # 创建新 Agent
-    new_agent, error = await create_agent(chat_key, new_requirement, difficulty)
+    # 创建新 Agent（同时复制 HTML 和相关信息）
+    new_agent, error = await create_agent(
+        chat_key,
+        new_requirement,
+        difficulty,
+        fork_from=source_agent,
+    )
     if error:
         return None, error
     if not new_agent:
         return None, "创建新 Agent 失败"
 
-    # 复制 HTML 和相关信息
-    new_agent.current_html = source_agent.current_html
-    new_agent.template_vars = source_agent.template_vars.copy()
-    new_agent.page_title = source_agent.page_title
-    new_agent.page_description = source_agent.page_description
-
-    # 添加分支说明到消息
-    new_agent.add_message(
-        msg_type=MessageType.INSTRUCTION,
-        sender="main",
-        content=f"[基于 {source_agent_id} 分支] {new_requirement}",
-    )
-
-    await update_agent(new_agent)
     logger.info(f"从 {source_agent_id} 分支创建新 Agent: {new_agent.agent_id}")
     return new_agent, None
 
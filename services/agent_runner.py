@@ -8,22 +8,18 @@ import contextlib
 import re
 import time
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from nekro_agent.api.core import config as core_config
 from nekro_agent.api.core import logger
-from nekro_agent.services.agent.creator import OpenAIChatMessage
 from nekro_agent.services.agent.openai import gen_openai_chat_response
 
 from ..models import AgentStatus, MessageType, WebDevAgent, WebDevResponse
 from ..plugin import config
 from .agent_pool import (
+    agent_transaction,
     fail_agent,
     get_agent,
-    update_agent,
-    update_agent_deployed_url,
-    update_agent_html,
-    update_agent_progress,
     update_agent_status,
 )
 from .deploy import deploy_html_to_worker
@@ -32,6 +28,28 @@ from .message_bus import notify_main_agent
 # 正在运行的 Agent 任务: (agent_id, chat_key) -> Task
 _running_tasks: dict[tuple[str, str], asyncio.Task] = {}
 
+# 响应解析正则（模块加载时编译一次）
+# 匹配 <<<<<<< SEARCH ... ======= ... >>>>>>> REPLACE
+_SEARCH_REPLACE_PATTERN = re.compile(
+    r"<{7}\s*SEARCH\s*\n(.*?)\n={7}\s*\n(.*?)\n>{7}\s*REPLACE",
+    re.DOTALL,
+)
+_STATUS_PATTERN = re.compile(
+    r"<status>\s*progress:\s*(\d+)\s*step:\s*[\"']?([^\"'\n<]+)[\"']?\s*</status>",
+    re.DOTALL | re.IGNORECASE,
+)
+_MESSAGE_PATTERN = re.compile(
+    r'<message\s+type=["\']?(question|progress|result)["\']?\s*>(.*?)</message>',
+    re.DOTALL | re.IGNORECASE,
+)
+_CODE_BLOCK_PATTERN = re.compile(r"<code>\s*(.*?)\s*</code>", re.DOTALL)
+_HTML_FENCE_PATTERN = re.compile(r"```html\s*(.*?)\s*```", re.DOTALL)
+_HTML_DOC_PATTERN = re.compile(r"(<!DOCTYPE html>.*?</html>)", re.DOTALL | re.IGNORECASE)
+_TITLE_TAG_PATTERN = re.compile(r"<title>(.+?)</title>", re.IGNORECASE)
+_TITLE_COMMENT_PATTERN = re.compile(r"<!--\s*TITLE:\s*(.+?)\s*-->")
+_DESC_COMMENT_PATTERN = re.compile(r"<!--\s*DESC:\s*(.+?)\s*-->")
+_META_COMMENT_STRIP_PATTERN = re.compile(r"<!--\s*(?:TITLE|DESC):.*?-->")
+
 
 @dataclass
 class SearchReplaceBlock:
@@ -59,13 +77,7 @@ def parse_search_replace_blocks(raw_response: str) -> List[SearchReplaceBlock]:
     """
     blocks: List[SearchReplaceBlock] = []
 
-    # 匹配 <<<<<<< SEARCH ... ======= ... >>>>>>> REPLACE
-    pattern = re.compile(
-        r"<{7}\s*SEARCH\s*\n(.*?)\n={7}\s*\n(.*?)\n>{7}\s*REPLACE",
-        re.DOTALL,
-    )
-
-    for match in pattern.finditer(raw_response):
+    for match in _SEARCH_REPLACE_PATTERN.finditer(raw_response):
         search_content = match.group(1)
         replace_content = match.group(2)
 
@@ -135,28 +147,28 @@ def _get_model_groups_with_fallback(difficulty: int) -> List[str]:
 
 
 async def _call_llm_with_fallback(
-    messages: List[OpenAIChatMessage],
+    messages: List[Dict[str, Any]],
     model_groups: List[str],
     agent_id: str,
 ) -> Tuple[Optional[str], Optional[str]]:
     """调用 LLM，支持自动降级
 
     Args:
-        messages: 消息列表
+        messages: 消息字典列表
         model_groups: 模型组列表（按优先级排序）
         agent_id: Agent ID（用于日志）
 
     Returns:
         (响应内容, 错误信息) - 成功时错误信息为 None
     """
-    last_error: Optional[str] = None
 
-    for i, model_group_name in enumerate(model_groups):
-        is_fallback = i > 0
+    async def _try_model(i: int) -> Tuple[Optional[str], Optional[str]]:
+        """调用第 i 个模型组"""
+        model_group_name = model_groups[i]
         try:
             model_group = core_config.get_model_group_info(model_group_name)
 
-            if is_fallback:
+            if i > 0:
                 logger.warning(f"Agent {agent_id} 降级到模型: {model_group.CHAT_MODEL}")
             else:
                 logger.info(
@@ -178,18 +190,61 @@ async def _call_llm_with_fallback(
                 proxy_url=model_group.CHAT_PROXY,
             )
         except Exception as e:
-            error_msg = str(e)
-            last_error = f"模型 {model_group_name} 调用失败: {error_msg}"
-            logger.error(f"Agent {agent_id} {last_error}")
-
-            # 如果还有降级选项，记录日志
-            has_more = i < len(model_groups) - 1
-            if has_more:
-                logger.info(f"Agent {agent_id} 尝试降级到下一个模型...")
+            error_msg = f"模型 {model_group_name} 调用失败: {e}"
+            logger.error(f"Agent {agent_id} {error_msg}")
+            return None, error_msg
         else:
             # 调用成功
             return response.response_content, None
 
+    last_error: Optional[str] = None
+    next_index = 0
+    last_launch = 0.0
+    pending: set[asyncio.Task] = set()
+
+    def _launch_next() -> None:
+        nonlocal next_index, last_launch
+        pending.add(asyncio.create_task(_try_model(next_index)))
+        next_index += 1
+        last_launch = time.monotonic()
+
+    try:
+        if model_groups:
+            _launch_next()
+        while pending:
+            # 开启对冲时，最近启动的请求超时未返回即提前启动下一个模型
+            timeout: Optional[float] = None
+            if config.FALLBACK_HEDGE_SECONDS > 0 and next_index < len(model_groups):
+                elapsed = time.monotonic() - last_launch
+                timeout = max(config.FALLBACK_HEDGE_SECONDS - elapsed, 0.0)
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if not done:
+                logger.info(
+                    f"Agent {agent_id} 模型 {config.FALLBACK_HEDGE_SECONDS} 秒内未返回，同时请求下一个模型...",
+                )
+                _launch_next()
+                continue
+
+            for task in done:
+                content, error = task.result()
+                if error is None:
+                    return content, None
+                last_error = error
+
+            # 失败后降级到下一个模型；仍有对冲请求进行中时继续等待它，不再额外启动
+            if not pending and next_index < len(model_groups):
+                logger.info(f"Agent {agent_id} 尝试降级到下一个模型...")
+                _launch_next()
+    finally:
+        # 取消仍在进行的请求（已有结果或外部取消）
+        for task in pending:
+            task.cancel()
+
     # 所有模型都失败了
     return None, last_error
 
@@ -213,20 +268,27 @@ async def run_webdev_agent_loop(agent_id: str, chat_key: str) -> None:
     logger.info(f"启动 WebDev Agent 工作循环: {agent_id}")
 
     try:
-        # 更新状态为思考中
-        await update_agent_status(agent_id, chat_key, AgentStatus.THINKING)
-        agent.start_time = int(time.time())
-        await update_agent(agent)
-
         # 构建消息并调用 LLM
-        from ..prompts.webdev_system import build_webdev_messages
+        from ..prompts.webdev_system import apply_cache_control, build_webdev_messages
 
-        messages = build_webdev_messages(agent)
+        # 消息只转换一次，降级重试与对冲请求共用同一份请求体
+        chat_messages = build_webdev_messages(agent)
+        if config.PROMPT_CACHE_CONTROL:
+            messages = apply_cache_control(chat_messages)
+        else:
+            messages = [msg.to_dict() for msg in chat_messages]
 
         # 获取模型列表（含降级）
         model_groups = _get_model_groups_with_fallback(agent.difficulty)
 
-        await update_agent_status(agent_id, chat_key, AgentStatus.CODING)
+        # 记录开始时间并更新状态为编码中
+        async with agent_transaction(chat_key, agent_id) as current:
+            if current is None:
+                logger.warning(f"Agent {agent_id} 已不在活跃状态")
+                return
+            current.touch()
+            current.start_time = int(time.time())
+            current.update_status(AgentStatus.CODING)
 
         # 调用 LLM（自动降级）
         raw_content, llm_error = await _call_llm_with_fallback(
@@ -259,47 +321,27 @@ async def run_webdev_agent_loop(agent_id: str, chat_key: str) -> None:
             return
         logger.debug(f"Agent {agent_id} LLM 响应长度: {len(raw_content)}")
 
-        # 解析响应
-        parsed = parse_webdev_response(raw_content)
-
-        # 更新进度
-        if parsed.progress_percent > 0 or parsed.current_step:
-            await update_agent_progress(
-                agent_id,
-                chat_key,
-                parsed.progress_percent,
-                parsed.current_step,
-            )
-
-        # 更新 Agent 对话历史（添加自己的回复）
-        agent = await get_agent(agent_id, chat_key)
-        if agent:
-            agent.add_message(
-                msg_type=MessageType.PROGRESS,
-                sender="webdev",
-                content=raw_content[:500] + "..."
-                if len(raw_content) > 500
-                else raw_content,
-            )
-            agent.iteration_count += 1
-            await update_agent(agent)
+        # 解析响应（纯 CPU 的正则扫描放到线程中执行，避免大段 HTML 阻塞事件循环）
+        parsed = await asyncio.to_thread(parse_webdev_response, raw_content)
 
         # 处理 HTML 代码（完整代码或增量编辑）
+        # 增量编辑在事务之外计算，避免持有注册表快照时切换线程、覆盖期间其他写入
         html_to_deploy: Optional[str] = None
         edit_applied = False
+        template_vars: Dict[str, str] = {}
 
         if parsed.html_content:
             # 有完整代码块，直接使用
             html_to_deploy = parsed.html_content
         else:
             # 尝试解析 Search/Replace 块
-            blocks = parse_search_replace_blocks(raw_content)
+            blocks = await asyncio.to_thread(parse_search_replace_blocks, raw_content)
             if blocks:
-                # 获取当前 HTML
-                agent = await get_agent(agent_id, chat_key)
-                if agent and agent.current_html:
-                    html_to_deploy, edit_errors = apply_search_replace_blocks(
-                        agent.current_html,
+                current = await get_agent(agent_id, chat_key, update_access=False)
+                if current and current.current_html:
+                    html_to_deploy, edit_errors = await asyncio.to_thread(
+                        apply_search_replace_blocks,
+                        current.current_html,
                         blocks,
                     )
                     edit_applied = True
@@ -308,25 +350,45 @@ async def run_webdev_agent_loop(agent_id: str, chat_key: str) -> None:
                 else:
                     logger.warning(f"Agent {agent_id} 尝试增量编辑但无现有 HTML")
 
-        if html_to_deploy:
-            await update_agent_html(
-                agent_id,
-                chat_key,
-                html_to_deploy,
-                parsed.page_title,
-                parsed.page_description,
+        # 进度、对话历史、代码修改与部署状态在同一次事务中写入
+        async with agent_transaction(chat_key, agent_id) as agent:
+            if agent is None:
+                # Agent 已不在活跃列表中（被取消或归档），结束工作循环
+                logger.info(f"Agent {agent_id} 已不在活跃状态，停止处理响应")
+                return
+
+            agent.touch()
+
+            # 更新进度
+            if parsed.progress_percent > 0 or parsed.current_step:
+                agent.update_progress(parsed.progress_percent, parsed.current_step)
+
+            # 更新 Agent 对话历史（添加自己的回复）
+            agent.add_message(
+                msg_type=MessageType.PROGRESS,
+                sender="webdev",
+                content=raw_content[:500] + "..."
+                if len(raw_content) > 500
+                else raw_content,
             )
+            agent.iteration_count += 1
 
-            # 部署到 Worker
-            await update_agent_status(agent_id, chat_key, AgentStatus.DEPLOYING)
+            if html_to_deploy:
+                agent.current_html = html_to_deploy
+                if parsed.page_title:
+                    agent.page_title = parsed.page_title
+                if parsed.page_description:
+                    agent.page_description = parsed.page_description
 
+                # 进入部署状态，同时取出模板变量用于部署
+                agent.update_status(AgentStatus.DEPLOYING)
+                template_vars = agent.template_vars.copy()
+
+        if html_to_deploy:
+            # 部署到 Worker
             title = parsed.page_title or f"WebApp by {agent_id}"
             description = parsed.page_description or "Generated by WebDev Agent"
 
-            # 获取最新的 agent 数据（包含模板变量）
-            agent = await get_agent(agent_id, chat_key)
-            template_vars = agent.template_vars if agent else {}
-
             deployed_url = await deploy_html_to_worker(
                 html_content=html_to_deploy,
                 title=title,
@@ -335,12 +397,11 @@ async def run_webdev_agent_loop(agent_id: str, chat_key: str) -> None:
             )
 
             if deployed_url:
-                await update_agent_deployed_url(agent_id, chat_key, deployed_url)
-                await update_agent_status(
-                    agent_id,
-                    chat_key,
-                    AgentStatus.WAITING_FEEDBACK,
-                )
+                async with agent_transaction(chat_key, agent_id) as agent:
+                    if agent:
+                        agent.touch()
+                        agent.deployed_url = deployed_url
+                        agent.update_status(AgentStatus.WAITING_FEEDBACK)
 
                 # 根据身份呈现模式构建通知文案
                 edit_info = "（增量更新）" if edit_applied else ""
@@ -403,6 +464,27 @@ async def run_webdev_agent_loop(agent_id: str, chat_key: str) -> None:
         )
 
 
+def _extract_meta_comments(html_content: str, result: WebDevResponse) -> str:
+    """提取 TITLE/DESC 注释到响应对象
+
+    Args:
+        html_content: 代码块中的 HTML
+        result: 解析结果，写入页面标题和描述
+
+    Returns:
+        清理注释后的 HTML
+    """
+    title_match = _TITLE_COMMENT_PATTERN.search(html_content)
+    desc_match = _DESC_COMMENT_PATTERN.search(html_content)
+
+    if title_match:
+        result.page_title = title_match.group(1).strip()
+    if desc_match:
+        result.page_description = desc_match.group(1).strip()
+
+    return _META_COMMENT_STRIP_PATTERN.sub("", html_content).strip()
+
+
 def parse_webdev_response(raw_response: str) -> WebDevResponse:
     """解析子 Agent 的响应
 
@@ -415,21 +497,13 @@ def parse_webdev_response(raw_response: str) -> WebDevResponse:
     result = WebDevResponse(raw_response=raw_response)
 
     # 解析 <status> 块
-    status_match = re.search(
-        r"<status>\s*progress:\s*(\d+)\s*step:\s*[\"']?([^\"'\n<]+)[\"']?\s*</status>",
-        raw_response,
-        re.DOTALL | re.IGNORECASE,
-    )
+    status_match = _STATUS_PATTERN.search(raw_response)
     if status_match:
         result.progress_percent = int(status_match.group(1))
         result.current_step = status_match.group(2).strip()
 
     # 解析 <message> 块
-    message_match = re.search(
-        r'<message\s+type=["\']?(question|progress|result)["\']?\s*>(.*?)</message>',
-        raw_response,
-        re.DOTALL | re.IGNORECASE,
-    )
+    message_match = _MESSAGE_PATTERN.search(raw_response)
     if message_match:
         msg_type_str = message_match.group(1).lower()
         result.message_to_main = message_match.group(2).strip()
@@ -440,63 +514,36 @@ def parse_webdev_response(raw_response: str) -> WebDevResponse:
         }.get(msg_type_str, MessageType.PROGRESS)
 
     # 解析 <code> 块中的 HTML
-    code_match = re.search(r"<code>\s*(.*?)\s*</code>", raw_response, re.DOTALL)
+    code_match = _CODE_BLOCK_PATTERN.search(raw_response)
     if code_match:
-        html_content = code_match.group(1).strip()
-
-        # 提取标题和描述注释
-        title_match = re.search(r"<!--\s*TITLE:\s*(.+?)\s*-->", html_content)
-        desc_match = re.search(r"<!--\s*DESC:\s*(.+?)\s*-->", html_content)
-
-        if title_match:
-            result.page_title = title_match.group(1).strip()
-        if desc_match:
-            result.page_description = desc_match.group(1).strip()
-
-        # 清理注释后的 HTML
-        html_content = re.sub(r"<!--\s*TITLE:.*?-->", "", html_content)
-        html_content = re.sub(r"<!--\s*DESC:.*?-->", "", html_content)
-        result.html_content = html_content.strip()
+        result.html_content = _extract_meta_comments(code_match.group(1).strip(), result)
 
     # 如果没有 <code> 块，尝试直接提取 HTML
     if not result.html_content:
         # 尝试匹配 ```html ... ``` 代码块
-        html_block_match = re.search(r"```html\s*(.*?)\s*```", raw_response, re.DOTALL)
+        html_block_match = _HTML_FENCE_PATTERN.search(raw_response)
         if html_block_match:
-            html_content = html_block_match.group(1).strip()
-
-            # 提取标题和描述
-            title_match = re.search(r"<!--\s*TITLE:\s*(.+?)\s*-->", html_content)
-            desc_match = re.search(r"<!--\s*DESC:\s*(.+?)\s*-->", html_content)
-
-            if title_match:
-                result.page_title = title_match.group(1).strip()
-            if desc_match:
-                result.page_description = desc_match.group(1).strip()
-
-            # 清理注释
-            html_content = re.sub(r"<!--\s*TITLE:.*?-->", "", html_content)
-            html_content = re.sub(r"<!--\s*DESC:.*?-->", "", html_content)
-            result.html_content = html_content.strip()
+            result.html_content = _extract_meta_comments(
+                html_block_match.group(1).strip(),
+                result,
+            )
 
     # 如果还是没有，尝试直接查找完整的 HTML 文档
     if not result.html_content:
-        html_doc_match = re.search(
-            r"(<!DOCTYPE html>.*?</html>)",
-            raw_response,
-            re.DOTALL | re.IGNORECASE,
-        )
+        html_doc_match = _HTML_DOC_PATTERN.search(raw_response)
         if html_doc_match:
             result.html_content = html_doc_match.group(1).strip()
 
-            # 从 <title> 标签提取标题
-            if result.html_content:
-                title_tag_match = re.search(
-                    r"<title>(.+?)</title>",
-                    result.html_content,
-                    re.IGNORECASE,
-                )
-                if title_tag_match and not result.page_title:
+            # 从 <title> 标签提取标题（优先只扫描 <head> 部分）
+            if result.html_content and not result.page_title:
+                html_content = result.html_content
+                head_end = html_content.find("</head>")
+                title_tag_match = None
+                if head_end >= 0:
+                    title_tag_match = _TITLE_TAG_PATTERN.search(html_content, 0, head_end)
+                if not title_tag_match:
+                    title_tag_match = _TITLE_TAG_PATTERN.search(html_content)
+                if title_tag_match:
                     result.page_title = title_tag_match.group(1).strip()
 
     return result